@@ -1,5 +1,11 @@
 import sys
 import time
+import io
+import json
+import queue
+import struct
+import hashlib
+import threading
 
 import logging
 logger = logging.getLogger(__name__)
@@ -16,7 +22,7 @@ from PyQt5.QtCore import *
 from screeninfo import get_monitors
 
 # pip install pillow
-from PIL import ImageGrab
+from PIL import Image, ImageGrab
 
 # pip install easyocr
 import easyocr
@@ -103,49 +109,86 @@ class ChestException(Exception):
 
 class ChestCounter:
 
-    def __init__(self, log_callback):
+    def __init__(self, log_callback, log=logger):
         self.log_callback = log_callback
+        self.log = log
+        self.reset()
 
-    def parse(self, text_lines):
-        chests = []
-        chest = Chest()
-        has_player = False
-        has_source = False
-        for line in text_lines:
-            if len(line) == 0:
-                continue
-
-            logger.debug(line)
+    def reset(self):
+        self.chest = Chest()
+        self.chest_lines = []
+        self.has_player = False
+        self.has_source = False
 
-            if 'PRBS' in line:
-                pass # what's going on with this one?
-
-            if has_player or (len(chest.player) == 0 and line.startswith('From')):
-                if has_player:
-                    chest.player = line
-                else:
-                    s = line.split(' ')
-                    s.pop(0)
-                    chest.player = ' '.join(s).replace('.', '') # faulty dots are sometimes added by OCR
-                has_player = len(chest.player) == 0 # split over two lines
-            elif has_source or (len(chest.source) == 0 and line.startswith('Source')):
-                if has_source:
-                    chest.source = line
-                else:
-                    s = line.split(' ')
-                    s.pop(0)
-                    chest.source = ' '.join(s)
-                has_source = len(chest.source) == 0 # split over two lines
+    def parse(self, text_lines):
+        # single frame: anything left incomplete at the end is dropped
+        self.reset()
+        return list(self.feed(text_lines))
+
+    def feed(self, text_lines):
+        # streaming: the partly parsed chest is kept for the next frame
+        text_lines = [line for line in text_lines if len(line) > 0]
+        overlap = self._overlap(self.chest_lines, text_lines)
+        if overlap == len(self.chest_lines):
+            if overlap > 0:
+                self.log.debug(f'skipping {overlap} lines of incomplete chest')
+        else:
+            # opened chests moved the incomplete one to the top, it is shown again in full
+            # (its last line may have been cut off at the box edge, or OCR reads it differently now)
+            self.log.debug(f'restarting incomplete chest: {self.chest_lines}')
+            self.reset()
+            overlap = 0
+
+        for line in text_lines[overlap:]:
+            chest = self._push(line)
+            if chest is not None:
+                yield chest
+
+    def pending(self):
+        return len(self.chest_lines) > 0
+
+    def _overlap(self, chest_lines, current):
+        # opened chests are gone from the list, so a frame can only repeat the incomplete chest
+        size = 0
+        while size < min(len(chest_lines), len(current)) and chest_lines[size] == current[size]:
+            size += 1
+        return size
+
+    def _push(self, line):
+        self.log.debug(line)
+
+        chest = self.chest
+        self.chest_lines.append(line)
+
+        if 'PRBS' in line:
+            pass # what's going on with this one?
+
+        if self.has_player or (len(chest.player) == 0 and line.startswith('From')):
+            if self.has_player:
+                chest.player = line
             else:
-                chest.name = ' '.join([chest.name, line]).strip()
+                s = line.split(' ')
+                s.pop(0)
+                chest.player = ' '.join(s).replace('.', '') # faulty dots are sometimes added by OCR
+            self.has_player = len(chest.player) == 0 # split over two lines
+        elif self.has_source or (len(chest.source) == 0 and line.startswith('Source')):
+            if self.has_source:
+                chest.source = line
+            else:
+                s = line.split(' ')
+                s.pop(0)
+                chest.source = ' '.join(s)
+            self.has_source = len(chest.source) == 0 # split over two lines
+        else:
+            chest.name = ' '.join([chest.name, line]).strip()
 
-            if chest.valid():
-                chests.append(chest)
-                self.log_callback(str(chest))
-                logger.info(f' ---> {str(chest)}')
-                chest = Chest()
+        if chest.valid():
+            self.log_callback(str(chest))
+            self.log.info(f' ---> {str(chest)}')
+            self.reset()
+            return chest
 
-        return chests
+        return None
     
     def load(self):
         chests = []
@@ -218,6 +261,20 @@ class ChestCounter:
                 line = SEP.join(sources) + EOL
                 f.write(line)    
 
+    def totals(self, chests):
+        # chest count per (player, source), players matched like in _collect
+        players = {}
+        result = {}
+        for chest in chests:
+            player = chest.player
+            if player.upper() in players:
+                player = players[player.upper()]
+            else:
+                players[player.upper()] = player
+            key = (player, chest.source)
+            result[key] = result.get(key, 0) + chest.count
+        return result
+
     def report(self, chests):
         self._collect(chests)
 
@@ -353,6 +410,186 @@ class ChestCounter:
 
         doc.build(elements)
 
+
+class SessionRecorder:
+
+    # archive records: 1 byte kind, 4 bytes payload length, payload
+    FRAME = b'F' # sha1 hex digest + PNG image
+    GRAB = b'G'  # JSON with OCR text lines and parsed chests
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.session = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        # frames of earlier sessions in the same archive are not written again
+        self.frames, end = self._scan(filename)
+
+        self.file = open(filename, 'ab')
+        if self.file.tell() > end:
+            # drop a record left incomplete by a crash, so new records stay aligned
+            logger.warning(f'{filename}: dropping {self.file.tell() - end} bytes of incomplete record')
+            self.file.truncate(end)
+            self.file.seek(end)
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def read(filename):
+        try:
+            with open(filename, 'rb') as f:
+                while True:
+                    header = f.read(5)
+                    if len(header) < 5:
+                        break
+                    length = struct.unpack('<I', header[1:])[0]
+                    payload = f.read(length)
+                    if len(payload) < length:
+                        break # truncated by a crash while writing
+                    yield header[:1], payload
+        except FileNotFoundError:
+            pass
+
+    def _scan(self, filename):
+        # frame digests and end of the last complete record, without reading the images
+        frames = set()
+        end = 0
+        try:
+            with open(filename, 'rb') as f:
+                size = f.seek(0, io.SEEK_END)
+                f.seek(0)
+                while True:
+                    header = f.read(5)
+                    if len(header) < 5 or not header[:1] in (self.FRAME, self.GRAB):
+                        break
+                    length = struct.unpack('<I', header[1:])[0]
+                    if end + 5 + length > size:
+                        break
+                    if header[:1] == self.FRAME:
+                        try:
+                            frames.add(f.read(40).decode('ascii'))
+                        except UnicodeDecodeError:
+                            break
+                    end += 5 + length
+                    f.seek(end)
+        except FileNotFoundError:
+            pass
+        return frames, end
+
+    def record(self, box, image, text_lines, chests):
+        # runs on the capture thread, so only queue the data here
+        self.queue.put((list(box), image, list(text_lines), [list(chest) for chest in chests]))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except Exception:
+                logger.exception('Failed to record grab')
+
+    def _write(self, box, image, text_lines, chests):
+        frame = ''
+        if image is not None:
+            digest = hashlib.sha1(str(image.shape).encode('ascii'))
+            digest.update(image.tobytes())
+            frame = digest.hexdigest()
+            if not frame in self.frames:
+                png = io.BytesIO()
+                Image.fromarray(image).save(png, format='PNG')
+                self._append(self.FRAME, frame.encode('ascii') + png.getvalue())
+                self.frames.add(frame)
+
+        record = {
+            'session': self.session,
+            'time': datetime.now().strftime('%H:%M:%S'),
+            'box': box,
+            'frame': frame,
+            'lines': text_lines,
+            'chests': chests
+        }
+        self._append(self.GRAB, json.dumps(record).encode('utf-8'))
+        self.file.flush()
+
+    def _append(self, kind, payload):
+        self.file.write(kind + struct.pack('<I', len(payload)) + payload)
+
+
+def replay(filename, reocr=False):
+    counter = ChestCounter(lambda entry: None, logging.getLogger(f'{__name__}.replay'))
+    reader = easyocr.Reader(['en', 'de']) if reocr else None
+
+    def to_chest(columns):
+        chest = Chest()
+        chest.player, chest.source, chest.name = columns
+        return chest
+
+    frames = {}
+    session = None
+    recorded = []
+    replayed = []
+    grabs = 0
+    changed = 0
+    broken = 0
+    for kind, payload in SessionRecorder.read(filename):
+        try:
+            if kind == SessionRecorder.FRAME:
+                frames[payload[:40].decode('ascii')] = payload[40:]
+                continue
+            elif kind != SessionRecorder.GRAB:
+                raise ValueError(f'unknown record kind {kind}')
+
+            record = json.loads(payload)
+            frame = record['frame']
+            grab_session = record['session']
+            grab_time = record['time']
+            text_lines = record['lines']
+            before = [to_chest(columns) for columns in record['chests']]
+        except (ValueError, KeyError, TypeError) as e:
+            broken += 1
+            print(f'record after grab {grabs} is unreadable: {e}')
+            continue
+
+        grabs += 1
+
+        if reader is not None and frame in frames:
+            with Image.open(io.BytesIO(frames[frame])) as image:
+                text_lines = reader.readtext(numpy.array(image), detail=0)
+
+        if grab_session != session:
+            session = grab_session
+            counter.reset()
+
+        after = list(counter.feed(text_lines))
+        recorded.extend(before)
+        replayed.extend(after)
+
+        if [tuple(c) for c in before] != [tuple(c) for c in after]:
+            changed += 1
+            print(f'grab {grabs} ({grab_session} {grab_time}):')
+            for chest in before:
+                print(f'  - {chest} [{chest.name}]')
+            for chest in after:
+                print(f'  + {chest} [{chest.name}]')
+
+    recorded_totals = counter.totals(recorded)
+    replayed_totals = counter.totals(replayed)
+    for key in sorted(set(recorded_totals) | set(replayed_totals)):
+        if recorded_totals.get(key, 0) != replayed_totals.get(key, 0):
+            print(f'{key[0]}: {key[1]}: {recorded_totals.get(key, 0)} -> {replayed_totals.get(key, 0)}')
+
+    print(f'{grabs} grabs, {changed} changed, {broken} unreadable, {len(recorded)} chests recorded, {len(replayed)} replayed')
+    return 1 if changed > 0 or broken > 0 else 0
+
+
 def iconPushButton(base64, callback, width=0, height=0):
     pixmap = QPixmap()
     pixmap.loadFromData(QByteArray.fromBase64(base64))
@@ -374,6 +611,7 @@ def button_style(color):
 class OCRControl(QWidget):
 
     STEP = 10
+    SLIDER_DELAY = 100 # ms
 
     ICON_LEFT = b"PHN2ZyB3aWR0aD0iMjQiIGhlaWdodD0iMjQiIHhtbG5zPSJodHRwOi8vd3d3LnczLm9yZy8yMDAwL3N2ZyIgZmlsbC1ydWxlPSJldmVub2RkIiBjbGlwLXJ1bGU9ImV2ZW5vZGQiPjxwYXRoIGQ9Ik0xMiAwYzYuNjIzIDAgMTIgNS4zNzcgMTIgMTJzLTUuMzc3IDEyLTEyIDEyLTEyLTUuMzc3LTEyLTEyIDUuMzc3LTEyIDEyLTEyem0wIDFjNi4wNzEgMCAxMSA0LjkyOSAxMSAxMXMtNC45MjkgMTEtMTEgMTEtMTEtNC45MjktMTEtMTEgNC45MjktMTEgMTEtMTF6bTMgNS43NTNsLTYuNDQgNS4yNDcgNi40NCA1LjI2My0uNjc4LjczNy03LjMyMi02IDcuMzM1LTYgLjY2NS43NTN6Ii8+PC9zdmc+"
     ICON_RIGHT = b"PHN2ZyB3aWR0aD0iMjQiIGhlaWdodD0iMjQiIHhtbG5zPSJodHRwOi8vd3d3LnczLm9yZy8yMDAwL3N2ZyIgZmlsbC1ydWxlPSJldmVub2RkIiBjbGlwLXJ1bGU9ImV2ZW5vZGQiPjxwYXRoIGQ9Ik0xMiAwYzYuNjIzIDAgMTIgNS4zNzcgMTIgMTJzLTUuMzc3IDEyLTEyIDEyLTEyLTUuMzc3LTEyLTEyIDUuMzc3LTEyIDEyLTEyem0wIDFjNi4wNzEgMCAxMSA0LjkyOSAxMSAxMXMtNC45MjkgMTEtMTEgMTEtMTEtNC45MjktMTEtMTEgNC45MjktMTEgMTEtMTF6bS0zIDUuNzUzbDYuNDQgNS4yNDctNi40NCA1LjI2My42NzguNzM3IDcuMzIyLTYtNy4zMzUtNi0uNjY1Ljc1M3oiLz48L3N2Zz4="
@@ -407,6 +645,14 @@ class OCRControl(QWidget):
         self.heightSlider.setSliderPosition(self.ocr.OCR_BOX[3])
         self.heightSlider.valueChanged.connect(self.heightChanged)
 
+        # apply slider values once they stop changing
+        self.sliderTimer = QTimer(self)
+        self.sliderTimer.setSingleShot(True)
+        self.sliderTimer.setInterval(self.SLIDER_DELAY)
+        self.sliderTimer.timeout.connect(self.applySliders)
+        self.widthPending = False
+        self.heightPending = False
+
         joystickGrid = QGridLayout()
         joystickGrid.addWidget(up, 0, 1)
         joystickGrid.addWidget(left, 1, 0)
@@ -472,10 +718,20 @@ class OCRControl(QWidget):
         self.ocr.move(self.type, 1 * self.STEP, 0)
 
     def widthChanged(self, value):
-        self.ocr.moveWidth(self.type, value)
+        self.widthPending = True
+        self.sliderTimer.start()
 
     def heightChanged(self, value):
-        self.ocr.moveHeight(self.type, value)
+        self.heightPending = True
+        self.sliderTimer.start()
+
+    def applySliders(self):
+        if self.widthPending:
+            self.ocr.moveWidth(self.type, self.widthSlider.value())
+        if self.heightPending:
+            self.ocr.moveHeight(self.type, self.heightSlider.value())
+        self.widthPending = False
+        self.heightPending = False
 
 
 class Dialog(QWidget):
@@ -499,6 +755,8 @@ class Dialog(QWidget):
 
         if self.settings.contains("ocr/calibrated"):
             self.ocr.ocr_calibrated = self.settings.value("ocr/calibrated") == 'true'
+        if self.settings.contains("record/enabled"):
+            self.ocr.record_enabled = self.settings.value("record/enabled") == 'true'
 
         self.setWindowTitle("Chest counter")
 
@@ -534,7 +792,13 @@ class Dialog(QWidget):
 
         buttonReport = iconPushButton(self.ICON_REPORT, self.ocr.on_report, 32, 32)
 
+        checkBoxRecord = QCheckBox(self)
+        checkBoxRecord.setText('Record session')
+        checkBoxRecord.setChecked(self.ocr.record_enabled)
+        checkBoxRecord.stateChanged.connect(self.toggleRecord)
+
         toolbar = QHBoxLayout()
+        toolbar.addWidget(checkBoxRecord)
         toolbar.addItem(QSpacerItem(20, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
         toolbar.addWidget(buttonReport)
 
@@ -556,6 +820,9 @@ class Dialog(QWidget):
         self.ocrControl.setVisible(checked)
         self.ocr.toggleOCR(checked)
 
+    def toggleRecord(self, checked):
+        self.ocr.record_enabled = checked != 0
+
     def log_entry(self, entry):
         item = QListWidgetItem(entry)
         self.listWidget.addItem(item)
@@ -577,6 +844,44 @@ class Dialog(QWidget):
         self.settings.setValue("visible", self.ocr.button_visible)
         self.settings.setValue("box", self.ocr.BUTTON)
         self.settings.endGroup()
+        self.settings.beginGroup("record")
+        self.settings.setValue("enabled", self.ocr.record_enabled)
+        self.settings.endGroup()
+
+
+class PreviewThread(QThread):
+
+    done = pyqtSignal(object, object, object)
+
+    def __init__(self, window, box):
+        super().__init__()
+        self.window = window
+        self.box = box
+
+    def run(self):
+        box = self.box
+        screenshot = ImageGrab.grab(bbox=(box[0], box[1], box[0] + box[2], box[1] + box[3]))
+
+        try:
+            image = numpy.array(screenshot)
+            with self.window.ocr_lock:
+                results = self.window.ocr.readtext(image)
+        except Exception as e:
+            logger.exception('Preview OCR failed')
+            results = []
+
+        screenshot.close()
+
+        # text boxes in window coordinates
+        boxes = []
+        for points, text, confidence in results:
+            xs = [int(p[0]) for p in points]
+            ys = [int(p[1]) for p in points]
+            boxes.append(QRect(box[0] + min(xs), box[1] + min(ys), max(xs) - min(xs), max(ys) - min(ys)))
+
+        chests = self.window.preview_counter.parse([text for points, text, confidence in results])
+
+        self.done.emit(box, boxes, chests)
 
 
 class OCRWindow(QMainWindow):
@@ -584,6 +889,12 @@ class OCRWindow(QMainWindow):
     OCR_BOX = (785, 400, 400, 380)
     BUTTON = (1340, 460, 16, 16)
 
+    PEN = 2
+    PREVIEW_DELAY = 500 # ms
+    PREVIEW_WIDTH = 400
+    PREVIEW_LINE = 20
+    PENDING_RETRIES = 3
+
     def __init__(self):
         super().__init__()
 
@@ -595,9 +906,24 @@ class OCRWindow(QMainWindow):
                 self.max_height = m.height
 
         self.ocr = easyocr.Reader(['en', 'de'])
+        self.ocr_lock = threading.Lock()
         self.ocr_visible = False
         self.button_visible = False
         self.ocr_calibrated = False
+        self.record_enabled = False
+        self.recorder = None
+
+        # live OCR preview, run in background once the box stops moving
+        self.preview = None
+        self.preview_thread = None
+        # preview chests are not counted, keep them out of chests.log
+        preview_log = logging.getLogger(f'{__name__}.preview')
+        preview_log.setLevel(logging.WARNING)
+        self.preview_counter = ChestCounter(lambda entry: None, preview_log)
+        self.previewTimer = QTimer(self)
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(self.PREVIEW_DELAY)
+        self.previewTimer.timeout.connect(self.run_preview)
 
         self.dialog = Dialog(self)
         self.dialog.show()
@@ -614,39 +940,119 @@ class OCRWindow(QMainWindow):
 
     def move(self, type, x, y):
         if type == 'ocr':
+            region = self._ocr_region()
             self.OCR_BOX = (self.OCR_BOX[0] + x, self.OCR_BOX[1] + y, self.OCR_BOX[2] + x, self.OCR_BOX[3] + y)
+            self._ocr_changed(region)
         else:
+            region = QRegion(self._rect(self.BUTTON))
             self.BUTTON = (self.BUTTON[0] + x, self.BUTTON[1] + y, self.BUTTON[2], self.BUTTON[3])
-        self.update()
+            self.update(region + QRegion(self._rect(self.BUTTON)))
         self.update_calibrated(False)
 
     def moveWidth(self, type, width):
+        region = self._ocr_region()
         self.OCR_BOX = (self.OCR_BOX[0], self.OCR_BOX[1], width, self.OCR_BOX[3])
-        self.update()
+        self._ocr_changed(region)
         self.update_calibrated(False)
 
     def moveHeight(self, type, height):
+        region = self._ocr_region()
         self.OCR_BOX = (self.OCR_BOX[0], self.OCR_BOX[1], self.OCR_BOX[2], height)
-        self.update()
+        self._ocr_changed(region)
         self.update_calibrated(False)
 
     def toggleOCR(self, checked):
         self.ocr_visible = checked
-        self.update()
+        region = self._ocr_region() + QRegion(self._rect(self.BUTTON))
+        self.preview = None
+        self.update(region)
+        if checked:
+            self.previewTimer.start()
+        else:
+            self.previewTimer.stop()
+
+    def _rect(self, box):
+        # include the pen drawn around the box
+        return QRect(box[0], box[1], box[2], box[3]).adjusted(-self.PEN, -self.PEN, self.PEN, self.PEN)
+
+    def _preview_rect(self):
+        lines = len(self.preview[2]) if self.preview is not None else 0
+        height = max(self.OCR_BOX[3], lines * self.PREVIEW_LINE)
+        return QRect(self.OCR_BOX[0] + self.OCR_BOX[2] + 2 * self.PEN, self.OCR_BOX[1], self.PREVIEW_WIDTH, height)
+
+    def _ocr_region(self):
+        region = QRegion(self._rect(self.OCR_BOX))
+        if self.preview is not None:
+            region += QRegion(self._preview_rect())
+        return region
+
+    def _ocr_changed(self, region):
+        # repaint old and new position only, the preview is outdated now
+        self.preview = None
+        self.update(region + self._ocr_region())
+        self.previewTimer.start()
+
+    def run_preview(self):
+        if not self.ocr_visible:
+            return
+        if self.preview_thread is not None and self.preview_thread.isRunning():
+            self.previewTimer.start() # try again when the running pass is done
+            return
+        self.preview_thread = PreviewThread(self, tuple(self.OCR_BOX))
+        self.preview_thread.done.connect(self.on_preview)
+        self.preview_thread.start()
+
+    def on_preview(self, box, boxes, chests):
+        if self.sender() is not self.preview_thread:
+            return # pass was abandoned by start()
+        if not self.ocr_visible or box != tuple(self.OCR_BOX):
+            return # box was moved in the meantime
+
+        self.preview = (box, boxes, chests)
+        self.update(self._ocr_region())
+
+        if len(chests) > 0 and not self.ocr_calibrated:
+            self.dialog.log_entry(f'Calibration OK: found {len(chests)} chests')
+            self.update_calibrated(True)
+
+    def clear_preview(self):
+        # keep preview boxes out of the screenshot
+        if self.preview is not None:
+            region = self._ocr_region()
+            self.preview = None
+            self.repaint(region)
 
     def paintEvent(self, e):
         qp = QPainter()
         qp.begin(self)
         if self.ocr_visible or self.button_visible:
-            qp.setPen(QPen(Qt.red, 2, Qt.SolidLine))
+            qp.setPen(QPen(Qt.red, self.PEN, Qt.SolidLine))
             qp.drawRect(self.OCR_BOX[0], self.OCR_BOX[1], self.OCR_BOX[2], self.OCR_BOX[3])
             qp.drawRect(self.BUTTON[0], self.BUTTON[1], self.BUTTON[2], self.BUTTON[3])
+
+        if self.ocr_visible and self.preview is not None:
+            box, boxes, chests = self.preview
+            qp.setPen(QPen(Qt.green, 1, Qt.SolidLine))
+            for rect in boxes:
+                qp.drawRect(rect)
+
+            rect = self._preview_rect()
+            if e.rect().intersects(rect) and len(chests) > 0:
+                qp.fillRect(rect.x(), rect.y(), rect.width(), len(chests) * self.PREVIEW_LINE, QColor(0, 0, 0, 160))
+                qp.setPen(QPen(Qt.white))
+                for i, chest in enumerate(chests):
+                    qp.drawText(rect.x() + 4, rect.y() + i * self.PREVIEW_LINE, rect.width() - 8, self.PREVIEW_LINE,
+                                Qt.AlignLeft | Qt.AlignVCenter, str(chest))
         qp.end()
 
+    def closeEvent(self, event):
+        self.stop_preview()
+        event.accept()
+
     def test(self):
         chests = self.grab()
-        result = len(chests) == 4
-        self.dialog.log_entry(f'Calibration {"OK" if result else "FAILED"}: found {len(chests)} of 4 chests')
+        result = len(chests) > 0
+        self.dialog.log_entry(f'Calibration {"OK" if result else "FAILED"}: found {len(chests)} chests')
         self.dialog.activateWindow()
         self.update_calibrated(result)
 
@@ -656,14 +1062,43 @@ class OCRWindow(QMainWindow):
         self.ocr_calibrated = value
         self.dialog.on_calibrated()
 
+    def stop_preview(self):
+        # a pending result would show a screen that changed in the meantime
+        self.previewTimer.stop()
+        if self.preview_thread is not None:
+            self.preview_thread.wait()
+            self.preview_thread = None
+
     def start(self):
-        while (True):    
-            chests = self.grab()
-            if len(chests) > 0:
-                self.total_chests.extend(chests)
-                self.next()
-            else:
-                break
+        self.stop_preview()
+
+        if self.record_enabled:
+            date = datetime.today().strftime('%Y-%m-%d')
+            self.recorder = SessionRecorder("session_" + date + '.rec')
+            self.dialog.log_entry(f'Recording to {self.recorder.filename}')
+
+        self.counter.reset()
+        retries = 0
+        try:
+            while (True):    
+                chests = self.grab(stream=True)
+                if len(chests) > 0:
+                    retries = 0
+                    self.total_chests.extend(chests)
+                    self.next(len(chests))
+                elif self.counter.pending() and retries < self.PENDING_RETRIES:
+                    # incomplete chest, the list may still be scrolling
+                    retries += 1
+                    time.sleep(0.5)
+                else:
+                    break
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
+                self.recorder = None
+
+        if self.counter.pending():
+            logger.info(f'incomplete chest dropped: {str(self.counter.chest)}')
 
         self.dialog.log_entry(f'Total chests: {len(self.total_chests)}')
 
@@ -671,31 +1106,47 @@ class OCRWindow(QMainWindow):
 
         self.counter.save(self.total_chests)
 
-    def grab(self):
+        self.previewTimer.start()
+
+    def grab(self, stream=False):
+        self.clear_preview()
+
         screenshot = ImageGrab.grab(bbox=(self.OCR_BOX[0], self.OCR_BOX[1], self.OCR_BOX[0] + self.OCR_BOX[2], self.OCR_BOX[1] + self.OCR_BOX[3]))
 
+        image = None
         try:
             image = numpy.array(screenshot)
-            text_lines = self.ocr.readtext(image, detail=0)
+            with self.ocr_lock:
+                text_lines = self.ocr.readtext(image, detail=0)
         except Exception as e:
             text_lines = []
 
         screenshot.close()
 
         try:
-            chests = self.counter.parse(text_lines)
+            if stream:
+                chests = list(self.counter.feed(text_lines))
+            else:
+                chests = self.counter.parse(text_lines)
         except ChestException:
             chests = []
 
+        if self.recorder is not None:
+            self.recorder.record(self.OCR_BOX, image, text_lines, chests)
+
         return chests
     
-    def next(self):
-        for i in range(4):
+    def next(self, count):
+        for i in range(count):
             pyautogui.click(self.BUTTON[0] + (self.BUTTON[2] / 2), self.BUTTON[1] + (self.BUTTON[3] / 2))
             time.sleep(0.5)
 
 
 if __name__ == '__main__':
+    # python chests.py replay session_<date>.rec [--ocr]
+    if len(sys.argv) > 2 and sys.argv[1] == 'replay':
+        sys.exit(replay(sys.argv[2], '--ocr' in sys.argv))
+
     app = QApplication(sys.argv)
     window = OCRWindow()
     window.show()